@@ -27,5 +27,8 @@ setup(
     install_requires=[
         'babel>=2.1.1, <3.0',
         'python-dateutil>=2.5.2, <3.0'
-    ]
+    ],
+    extras_require={
+        'speedups': ['ciso8601>=2.0']
+    }
 )
@@ -1,15 +1,21 @@
+import copy
 import math
+import os
+import pickle
 import time
 import unittest
+import weakref
 from datetime import datetime, timedelta
+from unittest import mock
 
-from dateutil.tz import tzutc, tzlocal
+from dateutil.parser import parse as dateutil_parse
+from dateutil.tz import tzoffset, tzutc, tzlocal
 
 from time_window import TimeWindow
 from time_window.helpers import (
-    ExpirableObject, make_sequence, gaps_iterator, floor_seconds,
-    utcfromtimestamp_tzaware, utcdatetime_tzaware, utc_from_local_date_parse,
-    utc_date_parse
+    ExpirableObject, expired_objects, make_sequence, gaps_iterator,
+    gaps_list, floor_seconds, utcfromtimestamp_tzaware, utcdatetime_tzaware,
+    utc_from_local_date_parse, utc_date_parse, utctimestamp_tzaware
 )
 
 
@@ -43,10 +49,31 @@ class TestFunctions(unittest.TestCase):
         a = []
         self.assertEqual([], [i for i in gaps_iterator(a)])
 
+        # A one-shot iterator
+        a = iter([4, 6, 2])
+        self.assertEqual([(4, 6), (6, 2)], [i for i in gaps_iterator(a)])
+
+    def test_gaps_list(self):
+        # A complete list
+        a = [4, 6, 2, 'a', '6']
+        a_gaps = [(4, 6), (6, 2), (2, 'a'), ('a', '6')]
+        self.assertEqual(a_gaps, gaps_list(a))
+
+        # One object list
+        self.assertEqual([], gaps_list([1]))
+
+        # Empty list
+        self.assertEqual([], gaps_list([]))
+
+        # A one-shot iterator
+        self.assertEqual([(1, 2), (2, 3), (3, 4), (4, 5)],
+                         gaps_list(iter([1, 2, 3, 4, 5])))
+
     def helper_time_periods_to_time_window_list(self, periods):
         return [
-            TimeWindow(*list(map(utcfromtimestamp_tzaware, period)))
-            for period in periods
+            TimeWindow(utcfromtimestamp_tzaware(since),
+                       utcfromtimestamp_tzaware(until))
+            for since, until in periods
         ]
 
     def test_floor_seconds(self):
@@ -67,7 +94,8 @@ class TestFunctions(unittest.TestCase):
     def test_utc_date_parse(self):
         date_text_samples = [
             '2015-06-10 10:00',
-            '2015-01-01T12:31:23'
+            '2015-01-01T12:31:23',
+            'June 10 2015 10:00'
         ]
         for sample in date_text_samples:
             parsed_date = utc_date_parse(sample)
@@ -83,6 +111,35 @@ class TestFunctions(unittest.TestCase):
             tuple(parsed_date.timetuple())[:6],
             (2015, 1, 1, 12, 31, 23)
         )
+        # Non ISO-8601 text falls back to the generic parser
+        parsed_date = utc_date_parse(date_text_samples[2])
+        self.assertTupleEqual(
+            tuple(parsed_date.timetuple())[:6],
+            (2015, 6, 10, 10, 0, 0)
+        )
+        # Bytes text is still handled by the generic parser
+        parsed_date = utc_date_parse(b'2015-06-10 10:00')
+        self.assertTupleEqual(
+            tuple(parsed_date.timetuple())[:6],
+            (2015, 6, 10, 10, 0, 0)
+        )
+        # The optional ciso8601 parser must not change the results
+        self.assertEqual(
+            utc_date_parse('2015-06'),
+            dateutil_parse('2015-06').replace(tzinfo=tzutc())
+        )
+        for sample in ['2015-161', '2015-06-10T24:00']:
+            with self.assertRaises(ValueError):
+                utc_date_parse(sample)
+
+    def test_utc_date_parse_current_date(self):
+        # Text without a date part is completed with the current date, so its
+        # parsing must not be memoized
+        with mock.patch('time_window.helpers.dateutil_parse',
+                        wraps=dateutil_parse) as parse:
+            utc_date_parse('10:00')
+            utc_date_parse('10:00')
+        self.assertEqual(parse.call_count, 2)
 
     def test_utc_from_local_date_parse(self):
 
@@ -95,6 +152,49 @@ class TestFunctions(unittest.TestCase):
         self.assertIsInstance(parsed_date_utc.tzinfo, tzutc)
         self.assertEqual(now, parsed_date_utc)
 
+        # Get the ISO-8601 representation
+        text_date = now.isoformat()
+        parsed_date_utc = utc_from_local_date_parse(text_date)
+
+        self.assertIsInstance(parsed_date_utc.tzinfo, tzutc)
+        self.assertEqual(now, parsed_date_utc)
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'requires time.tzset')
+    def test_utc_from_local_date_parse_tz_change(self):
+        original_tz = os.environ.get('TZ')
+        try:
+            os.environ['TZ'] = 'UTC'
+            time.tzset()
+            self.assertEqual(
+                utc_from_local_date_parse('2015-06-10 10:00'),
+                datetime(2015, 6, 10, 10, 0, 0, tzinfo=tzutc())
+            )
+
+            os.environ['TZ'] = 'Europe/Athens'
+            time.tzset()
+            self.assertEqual(
+                utc_from_local_date_parse('2015-06-10 10:00'),
+                datetime(2015, 6, 10, 7, 0, 0, tzinfo=tzutc())
+            )
+        finally:
+            if original_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = original_tz
+            time.tzset()
+
+    def test_utctimestamp_tzaware(self):
+        timestamp = 1420063200.0
+        examples = [
+            datetime(2014, 12, 31, 22, 0, 0, tzinfo=tzutc()),
+            datetime(2014, 12, 31, 22, 0, 0, 123456, tzinfo=tzutc()),
+            datetime(2015, 1, 1, 0, 0, 0, tzinfo=tzoffset(None, 7200)),
+            datetime(2014, 12, 31, 22, 0, 0)
+        ]
+        for example in examples:
+            self.assertEqual(timestamp, utctimestamp_tzaware(example))
+            self.assertIsInstance(utctimestamp_tzaware(example), float)
+
     def test_utcdatetime_tzaware(self):
         now = datetime.now()
 
@@ -114,6 +214,33 @@ class TestFunctions(unittest.TestCase):
         self.assertEqual(now.time(), utc_now.time())
 
 
+class NamedExpirableObject(ExpirableObject):
+
+    def __init__(self, name):
+        super(NamedExpirableObject, self).__init__()
+        self.name = name
+
+
+class SlottedExpirableObject(ExpirableObject):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        super(SlottedExpirableObject, self).__init__()
+        self.name = name
+
+
+class NeverExpiringObject(ExpirableObject):
+
+    def _is_expired_at(self, now):
+        return False
+
+
+class AlwaysAliveObject(ExpirableObject):
+
+    def is_expired(self):
+        return False
+
+
 class TestExpirableObject(unittest.TestCase):
 
     def test_constructor(self):
@@ -171,3 +298,117 @@ class TestExpirableObject(unittest.TestCase):
         self.assertEqual(o.expires_at - o.last_updated_at,
                          timedelta(seconds=10))
         self.assertFalse(o.is_expired())
+
+    def test_invalid_ttl(self):
+        o = ExpirableObject()
+        with self.assertRaises(ValueError):
+            o.ttl = float('nan')
+        self.assertTrue(math.isnan(o.ttl))
+        self.assertIsNone(o.expires_at)
+        self.assertIsNone(o.last_updated_at)
+        self.assertTrue(o.is_expired())
+
+        o.ttl = 35
+        expires_at = o.expires_at
+        with self.assertRaises(ValueError):
+            o.ttl = float('nan')
+        self.assertAlmostEqual(o.ttl, 35, delta=0.5)
+        self.assertEqual(o.expires_at, expires_at)
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            o = pickle.loads(pickle.dumps(ExpirableObject(), protocol))
+            self.assertTrue(math.isnan(o.ttl))
+            self.assertIsNone(o.expires_at)
+            self.assertIsNone(o.last_updated_at)
+            self.assertTrue(o.is_expired())
+
+            alive = NamedExpirableObject('alive')
+            alive.ttl = 35
+            o = pickle.loads(pickle.dumps(alive, protocol))
+            self.assertEqual(o.name, 'alive')
+            self.assertAlmostEqual(o.ttl, 35, delta=0.5)
+            self.assertEqual(o.expires_at, alive.expires_at)
+            self.assertEqual(o.last_updated_at, alive.last_updated_at)
+            self.assertFalse(o.is_expired())
+
+            expired = ExpirableObject()
+            expired.ttl = -1
+            o = pickle.loads(pickle.dumps(expired, protocol))
+            self.assertAlmostEqual(o.ttl, -1, delta=0.5)
+            self.assertTrue(o.is_expired())
+
+        # The slots of subclasses are kept
+        alive = SlottedExpirableObject('alive')
+        alive.ttl = 35
+        copies = [copy.copy(alive), copy.deepcopy(alive)] + [
+            pickle.loads(pickle.dumps(alive, protocol))
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1)
+        ]
+        for o in copies:
+            self.assertEqual(o.name, 'alive')
+            self.assertAlmostEqual(o.ttl, 35, delta=0.5)
+            self.assertEqual(o.expires_at, alive.expires_at)
+
+    def test_unpickle_legacy_state(self):
+        # The state of objects pickled by version 0.1.0
+        o = ExpirableObject.__new__(ExpirableObject)
+        o.__setstate__({'expires_at': None, 'last_updated_at': None})
+        self.assertTrue(math.isnan(o.ttl))
+        self.assertIsNone(o.expires_at)
+        self.assertIsNone(o.last_updated_at)
+        self.assertTrue(o.is_expired())
+
+        last_updated_at = utcfromtimestamp_tzaware(time.time() - 5)
+        o = NamedExpirableObject.__new__(NamedExpirableObject)
+        o.__setstate__({
+            'expires_at': last_updated_at + timedelta(seconds=35),
+            'last_updated_at': last_updated_at,
+            'name': 'alive'
+        })
+        self.assertEqual(o.name, 'alive')
+        self.assertAlmostEqual(o.ttl, 30, delta=0.5)
+        self.assertEqual(o.last_updated_at, last_updated_at)
+        self.assertEqual(o.expires_at,
+                         last_updated_at + timedelta(seconds=35))
+        self.assertFalse(o.is_expired())
+
+        o = ExpirableObject.__new__(ExpirableObject)
+        o.__setstate__({
+            'expires_at': last_updated_at + timedelta(seconds=1),
+            'last_updated_at': last_updated_at
+        })
+        self.assertAlmostEqual(o.ttl, -4, delta=0.5)
+        self.assertTrue(o.is_expired())
+
+    def test_weakref(self):
+        o = ExpirableObject()
+        ref = weakref.ref(o)
+        self.assertIs(ref(), o)
+
+    def test_expired_objects(self):
+        uninitialized = ExpirableObject()
+        alive = ExpirableObject()
+        alive.ttl = 35
+        expired = ExpirableObject()
+        expired.ttl = -1
+
+        self.assertListEqual([], expired_objects([]))
+        self.assertListEqual([], expired_objects([alive]))
+        self.assertListEqual(
+            [uninitialized, expired],
+            expired_objects([uninitialized, alive, expired])
+        )
+
+        # Subclasses can override the expiration check
+        never_expiring = NeverExpiringObject()
+        self.assertFalse(never_expiring.is_expired())
+        self.assertListEqual(
+            [uninitialized],
+            expired_objects([uninitialized, never_expiring])
+        )
+        always_alive = AlwaysAliveObject()
+        self.assertListEqual(
+            [uninitialized],
+            expired_objects([uninitialized, always_alive])
+        )
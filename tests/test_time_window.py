@@ -1,5 +1,10 @@
+import copy
 from datetime import datetime, timedelta
+import pickle
 import unittest
+import weakref
+
+from dateutil.tz import tzutc
 
 from time_window.helpers import gaps_iterator, utcfromtimestamp_tzaware
 from time_window import (
@@ -8,12 +13,26 @@ from time_window import (
 )
 
 
+class LabeledTimeWindow(TimeWindow):
+
+    def __init__(self, tm_since, tm_until, label=None):
+        super(LabeledTimeWindow, self).__init__(tm_since, tm_until)
+        self.label = label
+
+
 class TestTimeWindow(unittest.TestCase):
 
-    def setUp(self):
-        self.now = datetime.now()
+    @classmethod
+    def setUpClass(cls):
+        # TimeWindow objects are immutable, so the examples can be built
+        # once and shared between the tests.
+        cls.examples = cls.build_tm_windows_examples(datetime(2020, 1, 1, 12))
 
     def tm_windows_examples(self):
+        return dict(self.examples)
+
+    @staticmethod
+    def build_tm_windows_examples(now):
         """
         Generate a set of fixed time windows with the following
         relationships between them. The actual time scale and point in time
@@ -27,7 +46,6 @@ class TestTimeWindow(unittest.TestCase):
         Tsubset=          |_____|
         """
         examples = {}
-        now = self.now
         examples['Tbase'] = TimeWindow.from_timedelta(
             now,
             timedelta(minutes=10))
@@ -67,6 +85,12 @@ class TestTimeWindow(unittest.TestCase):
         with self.assertRaises(TypeError):
             TimeWindow(now, "string")
 
+        # Boundaries are read-only
+        with self.assertRaises(AttributeError):
+            tw.since = until
+        with self.assertRaises(AttributeError):
+            tw.until = now
+
     def test_property_middle(self):
         now = datetime.now()
         until = now + timedelta(minutes=10)
@@ -111,6 +135,11 @@ class TestTimeWindow(unittest.TestCase):
         ]
         for result, tw_set in tests:
             self.assertEqual(result, TimeWindow.smallest_possible(tw_set))
+            self.assertEqual(result,
+                             TimeWindow.smallest_possible(iter(tw_set)))
+
+        with self.assertRaises(ValueError):
+            TimeWindow.smallest_possible([])
 
     def test__repr__(self):
         ex = self.tm_windows_examples()
@@ -138,7 +167,8 @@ class TestTimeWindow(unittest.TestCase):
 
     def test_equalities(self):
         examples1 = self.tm_windows_examples()
-        examples2 = self.tm_windows_examples()
+        examples2 = self.build_tm_windows_examples(
+            examples1['Tbase'].since)
         # Create two independent lists of same examples and check
         # the expected comparison checks
         for example in examples1:
@@ -154,6 +184,25 @@ class TestTimeWindow(unittest.TestCase):
                     self.assertFalse(
                         examples1[example] == examples2[other_example])
 
+        # Comparisons between windows with cached hashes
+        for example in examples1:
+            hash(examples1[example])
+            hash(examples2[example])
+        self.assertEqual(examples1['Tbase'], examples2['Tbase'])
+        self.assertNotEqual(examples1['Tbase'], examples2['Tsubset'])
+
+        # Comparisons with unpickled windows with cached hashes
+        for example in examples1:
+            unpickled = pickle.loads(pickle.dumps(examples1[example]))
+            hash(unpickled)
+            self.assertEqual(unpickled, examples1[example])
+            self.assertFalse(unpickled != examples1[example])
+
+        # Comparison with other types
+        self.assertFalse(examples1['Tbase'] == examples1['Tbase'].since)
+        self.assertTrue(examples1['Tbase'] != examples1['Tbase'].since)
+        self.assertFalse(examples1['Tbase'] == None)  # NOQA
+
     def test_delta(self):
         ex = self.tm_windows_examples()
         self.assertEqual(ex['Tbase'].delta, timedelta(minutes=10))
@@ -348,6 +397,16 @@ class TestTimeWindow(unittest.TestCase):
         chunks = tw.split(td)
         generic_chunk_tests(chunks, td, 16, last_delta=timedelta(seconds=15))
 
+        # Empty window
+        chunks = TimeWindow(tw.since, tw.since).split(td)
+        self.assertEqual(chunks, [])
+
+        # Non positive delta
+        with self.assertRaises(ValueError):
+            tw.split(timedelta(0))
+        with self.assertRaises(ValueError):
+            tw.split(-td)
+
     def test_hash(self):
 
         hash1 = hash(TimeWindow.from_timedelta(datetime(2015, 1, 1),
@@ -373,6 +432,57 @@ class TestTimeWindow(unittest.TestCase):
                                            timedelta(seconds=2)))
         )
 
+    def test_pickle(self):
+        tw = TimeWindow.from_timedelta(datetime(2015, 1, 1),
+                                       timedelta(seconds=1))
+        hash(tw)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            loaded = pickle.loads(pickle.dumps(tw, protocol=protocol))
+            self.assertEqual(loaded.since, tw.since)
+            self.assertEqual(loaded.until, tw.until)
+            self.assertEqual(hash(loaded), hash(tw))
+
+        # A hash cached by another process is not carried over
+        tw._hash = hash(tw) + 1
+        loaded = pickle.loads(pickle.dumps(tw))
+        self.assertEqual(
+            hash(loaded),
+            hash(TimeWindow.from_timedelta(datetime(2015, 1, 1),
+                                           timedelta(seconds=1)))
+        )
+
+        # The attributes of subclasses are kept
+        labeled = LabeledTimeWindow(datetime(2015, 1, 1),
+                                    datetime(2015, 1, 2), 'x')
+        copies = [copy.copy(labeled), copy.deepcopy(labeled)] + [
+            pickle.loads(pickle.dumps(labeled, protocol=protocol))
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1)
+        ]
+        for loaded in copies:
+            self.assertIsInstance(loaded, LabeledTimeWindow)
+            self.assertEqual(loaded, labeled)
+            self.assertEqual(loaded.label, 'x')
+
+        # Time windows pickled by version 0.1.0
+        loaded = pickle.loads(
+            b'\x80\x02ctime_window.time_window\nTimeWindow\nq\x00)\x81q\x01}q'
+            b'\x02(X\x05\x00\x00\x00sinceq\x03cdatetime\ndatetime\nq\x04c_co'
+            b'decs\nencode\nq\x05X\x0b\x00\x00\x00\x07\xc3\x9f\x01\x01\x00'
+            b'\x00\x00\x00\x00\x00q\x06X\x06\x00\x00\x00latin1q\x07\x86q\x08'
+            b'Rq\t\x85q\nRq\x0bX\x05\x00\x00\x00untilq\x0ch\x04h\x05X\x0b'
+            b'\x00\x00\x00\x07\xc3\x9f\x01\x02\x00\x00\x00\x00\x00\x00q\rh'
+            b'\x07\x86q\x0eRq\x0f\x85q\x10Rq\x11ub.'
+        )
+        self.assertEqual(
+            loaded, TimeWindow(datetime(2015, 1, 1), datetime(2015, 1, 2)))
+        self.assertEqual(loaded.delta, timedelta(days=1))
+
+    def test_weakref(self):
+        tw = TimeWindow.from_timedelta(datetime(2015, 1, 1),
+                                       timedelta(seconds=1))
+        ref = weakref.ref(tw)
+        self.assertIs(ref(), tw)
+
     def test_split_per_day(self):
 
         # Single time test
@@ -655,6 +765,20 @@ class TestTimeWindow(unittest.TestCase):
              ]
         )
 
+        # Span two months, with timezone-aware boundaries
+        tw = TimeWindow(
+            datetime(2015, 12, 15, 5, tzinfo=tzutc()),
+            datetime(2016, 1, 6, 15, tzinfo=tzutc())
+        )
+        self.assertEqual(
+            tw.split_per_month(),
+            [TimeWindow(datetime(2015, 12, 15, 5, 0, tzinfo=tzutc()),
+                        datetime(2016, 1, 1, 0, 0, tzinfo=tzutc())),
+             TimeWindow(datetime(2016, 1, 1, 0, 0, tzinfo=tzutc()),
+                        datetime(2016, 1, 6, 15, 0, tzinfo=tzutc()))
+             ]
+        )
+
 
 class TestTimeWindowsCollection(unittest.TestCase):
 
@@ -723,6 +847,9 @@ class TestTimeWindowsCollection(unittest.TestCase):
             ),
         ])
 
+        # Test compressing an already compressed collection
+        self.assertIs(res.compressed(), res)
+
     def test_bug_compress_spatial_time_area(self):
         # This case was captured live on debugger.
         tws = TimeWindowsCollection([
@@ -885,6 +1012,111 @@ class TestTimeWindowsCollection(unittest.TestCase):
             ),
         ])
 
+    def test_complement_covered_period(self):
+        period = TimeWindow.from_timedelta(
+            datetime(2015, 2, 19, 1, 0, 0),
+            timedelta(hours=1)
+        )
+
+        # Test on a period fully covered by more than one time window
+        tws = TimeWindowsCollection([
+            TimeWindow.from_timedelta(
+                datetime(2015, 2, 19, 0, 50, 0),
+                timedelta(hours=2)
+            ),
+            TimeWindow.from_timedelta(
+                datetime(2015, 2, 19, 1, 20, 0),
+                timedelta(minutes=5)
+            ),
+        ])
+        res = tws.complement(period)
+        self.assertEqual(res.time_windows, [])
+
+    def test_contains(self):
+        base = datetime(2015, 2, 19, 1, 0, 0)
+        tws = TimeWindowsCollection([
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=20), timedelta(minutes=5)),
+            TimeWindow.from_timedelta(base, timedelta(minutes=15)),
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=10), timedelta(minutes=2)),
+        ])
+        tests = [(False, -1), (True, 0), (True, 11), (True, 14),
+                 (False, 15), (False, 19), (True, 20), (False, 25)]
+        for result, minutes in tests:
+            tm = base + timedelta(minutes=minutes)
+            self.assertEqual(result, tws.contains(tm),
+                             'Checking contains({0!r})'.format(tm))
+            self.assertEqual(result, tm in tws,
+                             'Checking contains({0!r})'.format(tm))
+
+        # Test on empty collection
+        self.assertFalse(base in TimeWindowsCollection([]))
+
+        # Assert the wrong type condition
+        with self.assertRaises(TypeError):
+            tws.contains(1)
+
+    def test_from_boundaries(self):
+        sinces = [datetime(2015, 2, 19, 1, 20, 0),
+                  datetime(2015, 2, 19, 0, 50, 0)]
+        untils = [datetime(2015, 2, 19, 1, 25, 0),
+                  datetime(2015, 2, 19, 1, 10, 0)]
+        tws = TimeWindowsCollection.from_boundaries(sinces, untils)
+        self.assertEqual(tws.time_windows, [
+            TimeWindow(sinces[0], untils[0]),
+            TimeWindow(sinces[1], untils[1]),
+        ])
+        self.assertEqual(tws.time_windows_sorted_by_since, [
+            TimeWindow(sinces[1], untils[1]),
+            TimeWindow(sinces[0], untils[0]),
+        ])
+
+        # Test empty boundaries
+        tws = TimeWindowsCollection.from_boundaries([], [])
+        self.assertEqual(tws.time_windows, [])
+
+        # Test boundaries of different length
+        with self.assertRaises(ValueError):
+            TimeWindowsCollection.from_boundaries(sinces, untils[:1])
+
+    def test_overlapping(self):
+        base = datetime(2015, 2, 19, 1, 0, 0)
+        tws = TimeWindowsCollection([
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=50), timedelta(minutes=20)),
+            TimeWindow.from_timedelta(base, timedelta(hours=1)),
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=10), timedelta(minutes=5)),
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=20), timedelta(minutes=5)),
+        ])
+
+        # Test on empty collection
+        res = TimeWindowsCollection([]).overlapping(
+            TimeWindow.from_timedelta(base, timedelta(minutes=10)))
+        self.assertEqual(res.time_windows, [])
+
+        queries = [
+            TimeWindow.from_timedelta(
+                base - timedelta(minutes=10), timedelta(minutes=10)),
+            TimeWindow.from_timedelta(base, timedelta(minutes=10)),
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=12), timedelta(minutes=10)),
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=15), timedelta(minutes=5)),
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=55), timedelta(minutes=1)),
+            TimeWindow.from_timedelta(
+                base + timedelta(minutes=70), timedelta(minutes=10)),
+        ]
+        for query in queries:
+            res = tws.overlapping(query)
+            expected = [tw for tw in tws.time_windows_sorted_by_since
+                        if tw.overlaps(query)]
+            self.assertEqual(res.time_windows, expected,
+                             'Checking overlapping({0!r})'.format(query))
+
     def test__repr__(self):
         tws = TimeWindowsCollection([
             TimeWindow.from_timedelta(
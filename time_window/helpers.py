@@ -1,9 +1,50 @@
-import math
-from calendar import timegm
+import copyreg
+import re
+import time
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import tee
 
 from dateutil.parser import parse as dateutil_parse
-from dateutil.tz import tzutc
+from dateutil.tz import tzlocal, tzutc
+
+try:
+    from itertools import pairwise as _pairwise
+except ImportError:
+    # Python < 3.10
+    def _pairwise(iterable):
+        current, following = tee(iterable)
+        next(following, None)
+        return zip(current, following)
+
+# The standard library parser (missing on Python < 3.7)
+_parse_isoformat = getattr(datetime, 'fromisoformat', None)
+
+try:
+    from ciso8601 import parse_datetime as _parse_ciso8601
+except ImportError:
+    pass
+else:
+    # ciso8601 also accepts reduced precision dates (completing '2015-06'
+    # with the first day of the month), ordinal dates and the 24:00 time of
+    # day, which the other parsers complete differently or reject. So it is
+    # only given text with a complete calendar date and any hour but 24, to
+    # return the same results as without it.
+    _CISO8601_TEXT = re.compile(r'\d{4}-\d{2}-\d{2}(?:$|[T ](?!24))')
+    _parse_stdlib_isoformat = _parse_isoformat
+
+    def _parse_isoformat(text):
+        if _CISO8601_TEXT.match(text) is not None:
+            try:
+                return _parse_ciso8601(text)
+            except ValueError:
+                pass
+        if _parse_stdlib_isoformat is None:
+            raise ValueError('Not an ISO-8601 text: {!r}'.format(text))
+        return _parse_stdlib_isoformat(text)
+
+_UTC = tzutc()
+_SEQUENCE_TYPES = (list, set, tuple)
 
 
 def make_sequence(elements):
@@ -11,10 +52,10 @@ def make_sequence(elements):
     Ensure that elements is a type of sequence, otherwise
     it converts it to a list with only one element.
     """
-    if isinstance(elements, (list, set, tuple)):
-        return elements
-    elif elements is None:
+    if elements is None:
         return []
+    elif isinstance(elements, _SEQUENCE_TYPES):
+        return elements
     else:
         return [elements]
 
@@ -27,35 +68,38 @@ def gaps_iterator(seq):
     Example:
      [3,4,5,6] -> [(3,4), (4,5), (5,6)]
     """
-    it = iter(seq)
-    try:
-        previous = next(it)
-    except StopIteration:
-        return
+    return _pairwise(seq)
 
-    while True:
-        try:
-            current = next(it)
-            yield (previous, current)
-            previous = current
-        except StopIteration:
-            return
+
+def gaps_list(seq):
+    """
+    Get a list with the gaps between elements of the sequence. This is the
+    eager equivalent of gaps_iterator, for when all the gaps are needed at
+    once.
+
+    Example:
+     [3,4,5,6] -> [(3,4), (4,5), (5,6)]
+    """
+    return list(gaps_iterator(seq))
 
 
 def utctimestamp_tzaware(dt):
     """
     Get a float representing the epoch time from a datetime object in UTC
-    timezone.
-    :param datetime dt: A datetime (timezone-aware) object
+    timezone. Any division of seconds is dropped.
+    :param datetime dt: A datetime (timezone-aware) object. Naive datetime
+    objects are considered to be in UTC timezone.
     """
-    return float(timegm(dt.timetuple()))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=_UTC)
+    return dt.replace(microsecond=0).timestamp()
 
 
 def utcnow_tzaware():
     """
     Get a datetime timezone-aware object of the current time in UTC zone
     """
-    return datetime.now(tzutc())
+    return datetime.now(_UTC)
 
 
 def utcfromtimestamp_tzaware(timestamp):
@@ -63,7 +107,7 @@ def utcfromtimestamp_tzaware(timestamp):
     Get datetime (timezone-aware) object in UTC timezone from timestamp.
     :param float timestamp: A float representing time in epoch timestamp.
     """
-    return datetime.fromtimestamp(timestamp, tz=tzutc())
+    return datetime.fromtimestamp(timestamp, tz=_UTC)
 
 
 def floor_seconds(dt):
@@ -72,7 +116,43 @@ def floor_seconds(dt):
     any division of seconds
     :param datetime dt: The datetime to round down.
     """
-    return dt - timedelta(microseconds=dt.microsecond)
+    return dt.replace(microsecond=0)
+
+
+@lru_cache(maxsize=4096)
+def _parse_iso(text):
+    """
+    Parse an ISO-8601 datetime text representation with a (much faster) C
+    parser, ciso8601 if it is installed (for the text it parses the same way)
+    or else the one of the standard library. Raises ValueError for any other
+    format.
+
+    Results are memoized, as the same text is usually parsed many times
+    (e.g. timestamps of log lines). This is safe since, unlike dateutil,
+    these parsers never complete the text with the current date.
+
+    :param unicode text: formatted datetime text
+    :rtype: datetime
+    """
+    return _parse_isoformat(text)
+
+
+def _parse_datetime(text):
+    """
+    Parse a datetime text representation. ISO-8601 text is handled by the
+    fast (and memoized) ISO parser, while any other format falls back to the
+    generic dateutil parser.
+
+    :param unicode text: formatted datetime text
+    :rtype: datetime
+    """
+    if _parse_isoformat is not None and isinstance(text, str):
+        try:
+            return _parse_iso(text)
+        except ValueError:
+            # Not an ISO-8601 text
+            pass
+    return dateutil_parse(text)
 
 
 def utc_date_parse(text):
@@ -83,22 +163,23 @@ def utc_date_parse(text):
     :param unicode text: formatted datetime text
     :rtype: datetime
     """
-    from dateutil.tz import tzutc
-    dt = dateutil_parse(text)
-    return dt.replace(tzinfo=tzutc())
+    dt = _parse_datetime(text)
+    return dt.replace(tzinfo=_UTC)
 
 
 def utc_from_local_date_parse(text):
     """
     Convert a valid datetime text representation given in local timezone
-    to a timezone-aware datetime object in UTC timezone
+    to a timezone-aware datetime object in UTC timezone. Text produced by
+    datetime.isoformat() or str(datetime) is parsed on the fast path.
 
     :param unicode text: formatted datetime text
     :rtype: datetime
     """
-    from dateutil.tz import tzlocal, tzutc
-    dt_local = dateutil_parse(text).replace(tzinfo=tzlocal())
-    return dt_local.astimezone(tzutc())
+    # tzlocal() reads the timezone offsets when it is created, so it is not
+    # cached in order to follow changes of the TZ environment variable
+    dt_local = _parse_datetime(text).replace(tzinfo=tzlocal())
+    return dt_local.astimezone(_UTC)
 
 
 def utcdatetime_tzaware(*args, **kwargs):
@@ -108,7 +189,7 @@ def utcdatetime_tzaware(*args, **kwargs):
     :return: A timezone-aware datetime object
     :rtype: datetime
     """
-    kwargs['tzinfo'] = tzutc()
+    kwargs['tzinfo'] = _UTC
     return datetime(*args, **kwargs)
 
 
@@ -125,22 +206,31 @@ class ExpirableObject(object):
         expires_at      -- Get the timestamp that this object will expire.
         last_updated_at -- Get the timestamp that this object was updated.
     """
+    __slots__ = (
+        '_ttl', '_last_updated_at', '_expires_at_monotonic', '__weakref__'
+    )
+
     def __init__(self):
         """
         The object is initialized in expired mode
         """
         super(ExpirableObject, self).__init__()
-        self.expires_at = None
-        self.last_updated_at = None
+        self._ttl = None
+        # The epoch timestamp of the last update
+        self._last_updated_at = None
+        # The deadline on the monotonic clock; an uninitialized object is
+        # always expired
+        self._expires_at_monotonic = float('-inf')
 
     @property
     def ttl(self):
         """
-        Get the current time-to-live of the object
+        Get the current time-to-live of the object. It is measured on a
+        monotonic clock, so that it is not affected by system clock updates.
         """
-        if self.expires_at is None:
+        if self._ttl is None:
             return float('nan')
-        return (self.expires_at - utcnow_tzaware()).total_seconds()
+        return self._expires_at_monotonic - time.monotonic()
 
     @ttl.setter
     def ttl(self, ttl):
@@ -148,13 +238,98 @@ class ExpirableObject(object):
         Refresh the object and a new expiration time-to-live
         :param int ttl: The time-to-live in seconds
         """
-        self.last_updated_at = utcnow_tzaware()
-        self.expires_at = \
-            self.last_updated_at + timedelta(seconds=ttl)
+        # Validate the ttl (e.g. NaN is rejected) before updating anything
+        ttl_delta = timedelta(seconds=ttl)
+        self._last_updated_at = time.time()
+        self._expires_at_monotonic = time.monotonic() + ttl
+        self._ttl = ttl_delta
+
+    @property
+    def last_updated_at(self):
+        """
+        Get the time (timezone-aware) that the ttl was last set
+        :rtype: datetime|None
+        """
+        if self._last_updated_at is None:
+            return None
+        return utcfromtimestamp_tzaware(self._last_updated_at)
+
+    @property
+    def expires_at(self):
+        """
+        Get the time (timezone-aware) that this object expires
+        :rtype: datetime|None
+        """
+        if self._last_updated_at is None:
+            return None
+        return self.last_updated_at + self._ttl
 
     def is_expired(self):
         """
         Check if the object has expired (ttl < 0 or uninitialized)
         :rtype: boolean
         """
-        return math.isnan(self.ttl) or self.ttl < 0
+        return self._is_expired_at(time.monotonic())
+
+    def _is_expired_at(self, now):
+        """
+        Check if the object has expired at a given time of the monotonic clock
+        :param float now: The time on the monotonic clock
+        :rtype: boolean
+        """
+        return now > self._expires_at_monotonic
+
+    def __getstate__(self):
+        # The monotonic clock has an arbitrary reference point that is not
+        # shared between processes, so the remaining ttl is pickled instead
+        # of the deadline.
+        state = dict(getattr(self, '__dict__', {}))
+        for name in copyreg._slotnames(type(self)):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        del state['_expires_at_monotonic']
+        state['_remaining_ttl'] = None if self._ttl is None else self.ttl
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        if '_remaining_ttl' in state:
+            remaining_ttl = state.pop('_remaining_ttl')
+        else:
+            # The state of objects pickled by version 0.1.0
+            expires_at = state.pop('expires_at')
+            last_updated_at = state.pop('last_updated_at')
+            if expires_at is None:
+                state['_ttl'] = None
+                state['_last_updated_at'] = None
+                remaining_ttl = None
+            else:
+                state['_ttl'] = expires_at - last_updated_at
+                state['_last_updated_at'] = last_updated_at.timestamp()
+                remaining_ttl = (expires_at - utcnow_tzaware()).total_seconds()
+        if remaining_ttl is None:
+            self._expires_at_monotonic = float('-inf')
+        else:
+            self._expires_at_monotonic = time.monotonic() + remaining_ttl
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+def expired_objects(expirable_objects):
+    """
+    Get the expired objects out of a sequence of ExpirableObject objects.
+    The clock is read only once for the whole sequence, which makes it
+    much cheaper than calling is_expired() on each object when sweeping
+    large collections. Objects of classes that override is_expired() are
+    checked by calling it.
+
+    :param list[ExpirableObject] expirable_objects: The objects to check
+    :rtype: list[ExpirableObject]
+    """
+    now = time.monotonic()
+    is_expired = ExpirableObject.is_expired
+    return [
+        o for o in expirable_objects
+        if (o._is_expired_at(now) if type(o).is_expired is is_expired
+            else o.is_expired())
+    ]
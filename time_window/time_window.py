@@ -1,12 +1,13 @@
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
-
-from babel.dates import format_timedelta
-from dateutil.relativedelta import relativedelta
+from operator import attrgetter
 
 from time_window.helpers import (
-    make_sequence, utcfromtimestamp_tzaware, utctimestamp_tzaware
+    gaps_iterator, utcfromtimestamp_tzaware, utctimestamp_tzaware
 )
 
+_ZERO_TIMEDELTA = timedelta(0)
+
 
 def _sort_time_windows_since(tw1, tw2):
     """
@@ -16,7 +17,7 @@ def _sort_time_windows_since(tw1, tw2):
     :return: A list with sorted time windows
     :rtype: list(TimeWindow)
     """
-    if tw1.since < tw2.since:
+    if tw1._since < tw2._since:
         return [tw1, tw2]
     else:
         return [tw2, tw1]
@@ -27,13 +28,15 @@ def _get_first_day_of_next_month(dt):
     Get the first day of next month for the given datetime object
     :param datetime dt: The datetime object to calculate the first day
         of next month
-    :return: The first day of the next month
+    :return: The first day of the next month, with the same tzinfo as dt
     :rtype: datetime
     """
-    next_month = dt + relativedelta(months=1)
-    next_month = next_month.replace(day=1)
-
-    return datetime.combine(next_month, datetime.min.time())
+    if dt.month == 12:
+        year, month = dt.year + 1, 1
+    else:
+        year, month = dt.year, dt.month + 1
+    return dt.replace(year=year, month=month, day=1,
+                      hour=0, minute=0, second=0, microsecond=0)
 
 
 class TimeWindow(object):
@@ -41,13 +44,16 @@ class TimeWindow(object):
     Representation of range in time space. The object represents all possible
     timestamps in range [since, until). Apart from representation TimeWindow
     provides a limited support for set operators like union, intersection,
-    complement.
+    complement. TimeWindow objects are immutable.
 
     Attributes:
         since    The lower (closed) boundary of this range
         until    The upper (open) boundary of this range
         delta    The distance between upper and lower boundaries.
     """
+    __slots__ = (
+        '_since', '_until', '_hash', '_delta', '_middle', '__weakref__'
+    )
 
     def __init__(self, tm_since, tm_until):
         """
@@ -63,8 +69,11 @@ class TimeWindow(object):
             raise TypeError('"until" must be of datetime.datetime type')
         if not tm_until >= tm_since:
             raise ValueError('"until" cannot be earlier of "since"')
-        self.since = tm_since
-        self.until = tm_until
+        self._since = tm_since
+        self._until = tm_until
+        self._hash = None
+        self._delta = None
+        self._middle = None
 
     @classmethod
     def from_timedelta(cls, tm, delta):
@@ -76,9 +85,9 @@ class TimeWindow(object):
         """
         assert isinstance(tm, datetime)
         assert isinstance(delta, timedelta)
-        boundaries = sorted([tm, tm + delta])
-
-        return cls(boundaries[0], boundaries[1])
+        if delta < _ZERO_TIMEDELTA:
+            return cls(tm + delta, tm)
+        return cls(tm, tm + delta)
 
     @classmethod
     def smallest_possible(cls, time_windows):
@@ -86,20 +95,48 @@ class TimeWindow(object):
         Get the smallest possible TimeWindow object that can contain
         a list of other TimeWindow objects.
 
-        :param list[TimeWindow] time_windows: A sequence of TimeWindow objects
+        :param list[TimeWindow] time_windows: A non-empty iterable of
+        TimeWindow objects
         :rtype: TimeWindow
         """
-        since = min([tw.since for tw in time_windows])
-        until = max([tw.until for tw in time_windows])
+        it = iter(time_windows)
+        try:
+            first = next(it)
+        except StopIteration:
+            raise ValueError('"time_windows" cannot be empty')
+        since, until = first._since, first._until
+        for tw in it:
+            if tw._since < since:
+                since = tw._since
+            if tw._until > until:
+                until = tw._until
         return cls(since, until)
 
+    @property
+    def since(self):
+        """
+        Get the lower (closed) boundary of this window.
+        :rtype: datetime
+        """
+        return self._since
+
+    @property
+    def until(self):
+        """
+        Get the upper (open) boundary of this window.
+        :rtype: datetime
+        """
+        return self._until
+
     @property
     def delta(self):
         """
         Get the delta (size) of this window.
         :rtype: timedelta
         """
-        return self.until - self.since
+        if self._delta is None:
+            self._delta = self._until - self._since
+        return self._delta
 
     @property
     def middle(self):
@@ -107,7 +144,9 @@ class TimeWindow(object):
         Get the time that is in the middle of this window.
         :rtype: datetime
         """
-        return self.since + self.delta/2
+        if self._middle is None:
+            self._middle = self._since + self.delta/2
+        return self._middle
 
     def overlaps(self, other):
         """
@@ -116,11 +155,12 @@ class TimeWindow(object):
         :return: Returns True if there is an overlapping or False.
         :rtype: bool
         """
-        since = max(self.since, other.since)
-        until = min(self.until, other.until)
-        if since >= until:
-            return False
-        return True
+        # Both windows must start before the other ends, and neither of
+        # them may be empty.
+        since, until = self._since, self._until
+        other_since, other_until = other._since, other._until
+        return (since < other_until and other_since < until
+                and since < until and other_since < other_until)
 
     def contiguous(self, other):
         """
@@ -136,10 +176,13 @@ class TimeWindow(object):
         the second object in the list.
 
         """
-        if not self.overlaps(other):
-            tws = _sort_time_windows_since(self, other)
-            if tws[0].until == tws[1].since:
-                return tws
+        if self.overlaps(other):
+            return False
+        if self._since < other._since:
+            if self._until == other._since:
+                return [self, other]
+        elif other._until == self._since:
+            return [other, self]
         return False
 
     def contains(self, other):
@@ -152,10 +195,10 @@ class TimeWindow(object):
         :rtype: bool
         """
         if isinstance(other, datetime):
-            return self.since <= other < self.until
+            return self._since <= other < self._until
         elif isinstance(other, TimeWindow):
-            return self.since <= other.since \
-                   and self.until >= other.until
+            return self._since <= other._since \
+                   and self._until >= other._until
         raise TypeError("Operator 'in' for {0} is undefined"
                         .format(other))
     __contains__ = contains
@@ -173,13 +216,14 @@ class TimeWindow(object):
         """
         if not self.overlaps(other):
             tws = _sort_time_windows_since(self, other)
-            if tws[0].until == tws[1].since:
-                return TimeWindow(tws[0].since, tws[1].until)
+            if tws[0]._until == tws[1]._since:
+                return TimeWindow(tws[0]._since, tws[1]._until)
             else:
                 return tws
-        since = min(self.since, other.since)
-        until = max(self.until, other.until)
-        return TimeWindow(since, until)
+        since, until = self._since, self._until
+        other_since, other_until = other._since, other._until
+        return TimeWindow(other_since if other_since < since else since,
+                          other_until if other_until > until else until)
     __or__ = union
 
     def intersection(self, other):
@@ -191,8 +235,12 @@ class TimeWindow(object):
         :param TimeWindow other: The other part of this operation
         :rtype None|TimeWindow
         """
-        since = max(self.since, other.since)
-        until = min(self.until, other.until)
+        since, until = self._since, self._until
+        other_since, other_until = other._since, other._until
+        if other_since > since:
+            since = other_since
+        if other_until < until:
+            until = other_until
         if since >= until:
             return None
         return TimeWindow(since, until)
@@ -211,23 +259,25 @@ class TimeWindow(object):
         :rtype: TimeWindow|list[TimeWindow]|None
         """
 
-        overlap = self & other
-        if overlap is None:
+        since, until = self._since, self._until
+        other_since, other_until = other._since, other._until
+        if not (since < other_until and other_since < until
+                and since < until and other_since < other_until):
             # No overlapping, means we return same object
-            return TimeWindow(self.since, self.until)
-        elif overlap == self:
-            # If we have complete overlapping, nothing is left back
-            return None
-        elif overlap.since == self.since:
+            return TimeWindow(since, until)
+        elif other_since <= since:
+            if other_until >= until:
+                # If we have complete overlapping, nothing is left back
+                return None
             # subtrahend is subset that have common start
-            return TimeWindow(overlap.until, self.until)
-        elif overlap.until == self.until:
+            return TimeWindow(other_until, until)
+        elif other_until >= until:
             # subtrahend is subset that have common end
-            return TimeWindow(self.since, overlap.since)
+            return TimeWindow(since, other_since)
         else:
             # subtrahend is subset with no common boundaries
-            return [TimeWindow(self.since, other.since),
-                    TimeWindow(other.until, self.until)
+            return [TimeWindow(since, other_since),
+                    TimeWindow(other_until, until)
                     ]
     __sub__ = complement
 
@@ -243,13 +293,35 @@ class TimeWindow(object):
 
         """
         assert isinstance(max_delta, timedelta)
-        chunks = []
-        chunk_since = self.since
-        while chunk_since < self.until:
-            chunk_delta = min(max_delta, self.until - chunk_since)
-            chunks.append(TimeWindow.from_timedelta(chunk_since, chunk_delta))
-            chunk_since += chunk_delta
-        return chunks
+        if max_delta <= _ZERO_TIMEDELTA:
+            raise ValueError('"max_delta" must be a positive time delta')
+        since = self._since
+        count, remainder = divmod(self._until - since, max_delta)
+        boundaries = [since + i * max_delta for i in range(count + 1)]
+        if remainder:
+            boundaries.append(self._until)
+        return [TimeWindow(chunk_since, chunk_until)
+                for chunk_since, chunk_until in gaps_iterator(boundaries)]
+
+    def _split_periodically(self, first_boundary, period):
+        """
+        Split time window on a series of equally spaced boundaries. All the
+        boundaries up to (and including) until are computed at once, instead
+        of stepping one period at a time.
+
+        :param datetime first_boundary: The first boundary after since
+        :param timedelta period: The distance between successive boundaries
+        :rtype: list[TimeWindow]
+        """
+        if first_boundary > self._until:
+            count = 0
+        else:
+            count = (self._until - first_boundary) // period + 1
+        boundaries = [self._since]
+        boundaries.extend(first_boundary + i * period for i in range(count))
+        boundaries.append(self._until)
+        return [TimeWindow(since, until)
+                for since, until in gaps_iterator(boundaries)]
 
     def split_per_day(self):
         """
@@ -257,19 +329,11 @@ class TimeWindow(object):
         100% overlapping with this one and the section has been performed
         on each change of day.
         """
-        day_periods = []
-        day_delta = timedelta(days=1)
-        start_time = self.since
-        while True:
-            end_time = (
-                start_time.replace(hour=0, minute=0, second=0, microsecond=0)
-                + day_delta
-            )
-            if end_time > self.until:
-                day_periods.append(TimeWindow(start_time, self.until))
-                return day_periods
-            day_periods.append(TimeWindow(start_time, end_time))
-            start_time = end_time
+        start_of_day = self._since.replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        return self._split_periodically(start_of_day + timedelta(days=1),
+                                        timedelta(days=1))
 
     def split_per_week(self):
         """"
@@ -277,21 +341,11 @@ class TimeWindow(object):
         100% overlapping with this one and the section has been performed
         on each change of week.
         """
-        week_periods = []
-        week_delta = timedelta(days=7)
-        start_time = self.since
-        while True:
-            beginning_of_week = start_time - timedelta(
-                days=start_time.weekday()
-            )
-            end_of_week = beginning_of_week.replace(
-                hour=0, minute=0, second=0, microsecond=0
-            ) + week_delta
-            if end_of_week > self.until:
-                week_periods.append(TimeWindow(start_time, self.until))
-                return week_periods
-            week_periods.append(TimeWindow(start_time, end_of_week))
-            start_time = end_of_week
+        start_of_week = self._since.replace(
+            hour=0, minute=0, second=0, microsecond=0
+        ) - timedelta(days=self._since.weekday())
+        return self._split_periodically(start_of_week + timedelta(days=7),
+                                        timedelta(days=7))
 
     def split_per_month(self):
         """"
@@ -299,35 +353,67 @@ class TimeWindow(object):
         100% overlapping with this one and the section has been performed
         on each change of month.
         """
-        month_periods = []
-        start_time = self.since
-        while True:
-            end_time = _get_first_day_of_next_month(start_time)
-            if end_time > self.until:
-                month_periods.append(TimeWindow(start_time, self.until))
-                return month_periods
-            month_periods.append(TimeWindow(start_time, end_time))
-            start_time = end_time
+        boundaries = [self._since]
+        start_of_month = _get_first_day_of_next_month(self._since)
+        while start_of_month <= self._until:
+            boundaries.append(start_of_month)
+            start_of_month = _get_first_day_of_next_month(start_of_month)
+        boundaries.append(self._until)
+        return [TimeWindow(since, until)
+                for since, until in gaps_iterator(boundaries)]
 
     def __eq__(self, other):
-        return self.since == other.since and self.until == other.until
+        if self is other:
+            return True
+        if not isinstance(other, TimeWindow):
+            return NotImplemented
+        # Equal windows have equal hashes, so when both hashes are already
+        # cached a mismatch settles it without comparing the boundaries.
+        if self._hash is not None and other._hash is not None \
+                and self._hash != other._hash:
+            return False
+        return self._since == other._since and self._until == other._until
 
     def __ne__(self, other):
-        return self.since != other.since or self.until != other.until
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return NotImplemented
+        return not equal
 
     def __str__(self):
+        # babel is imported here, as loading its locale data is slow and
+        # only needed for this human readable representation
+        from babel.dates import format_timedelta
         return "period of {delta}, from {s.since} to {s.until}".format(
             delta=format_timedelta(self.delta, locale='en_US'), s=self
         )
 
     def __repr__(self):
-        return "{cls.__name__}({since_repr}, {until_repr})" \
-            .format(cls=self.__class__,
-                    since_repr=repr(self.since),
-                    until_repr=repr(self.until))
+        return f"{type(self).__name__}({self._since!r}, {self._until!r})"
 
     def __hash__(self):
-        return hash((self.since, self.until,))
+        if self._hash is None:
+            self._hash = hash((self._since, self._until,))
+        return self._hash
+
+    def __reduce__(self):
+        # Pickle the boundaries (and the attributes of subclasses) but not the
+        # caches: the hash is only valid within the process that computed it,
+        # and the other caches are cheap to rebuild.
+        return (type(self), (self._since, self._until),
+                getattr(self, '__dict__', None))
+
+    def __setstate__(self, state):
+        state = dict(state)
+        if 'since' in state:
+            # The state of time windows pickled by version 0.1.0
+            self._since = state.pop('since')
+            self._until = state.pop('until')
+            self._hash = None
+            self._delta = None
+            self._middle = None
+        for name, value in state.items():
+            setattr(self, name, value)
 
 
 class TimeWindowsCollection(object):
@@ -348,6 +434,27 @@ class TimeWindowsCollection(object):
         else:
             self.__time_windows_sorted_by_since = None
         self.__time_windows_splitted = None
+        self.__index = None
+        self.__is_compressed = False
+        self.__compressed = None
+
+    @classmethod
+    def from_boundaries(cls, sinces, untils, sorted_since=False):
+        """
+        Construct a collection from two parallel sequences of boundaries, as
+        they are usually found in columnar data (e.g. two columns of a CSV
+        file), without building intermediate pairs.
+
+        :param list[datetime] sinces: The lower boundaries of the windows
+        :param list[datetime] untils: The upper boundaries of the windows
+        :param bool sorted_since: If true, then sinces is considered sorted.
+        :rtype: TimeWindowsCollection
+        """
+        if len(sinces) != len(untils):
+            raise ValueError('"sinces" and "untils" must have the same length')
+        return cls([TimeWindow(since, until)
+                    for since, until in zip(sinces, untils)],
+                   sorted_since=sorted_since)
 
     @property
     def time_windows(self):
@@ -357,40 +464,108 @@ class TimeWindowsCollection(object):
     def time_windows_sorted_by_since(self):
         if self.__time_windows_sorted_by_since is None:
             self.__time_windows_sorted_by_since = \
-                sorted(self.__time_windows_raw,
-                       key=lambda tw: tw.since)
+                sorted(self.__time_windows_raw, key=attrgetter('_since'))
         return self.__time_windows_sorted_by_since
 
+    def _get_index(self):
+        """
+        Get the search index of the collection, built on first use. The index
+        is a pair of lists aligned with the windows sorted by since: the
+        since of each window and the running maximum of until. Both lists
+        are sorted, so they can be binary searched.
+
+        :rtype: (list[datetime], list[datetime])
+        """
+        if self.__index is None:
+            time_windows = self.time_windows_sorted_by_since
+            sinces = [tw.since for tw in time_windows]
+            max_untils = []
+            max_until = None
+            for tw in time_windows:
+                if max_until is None or tw.until > max_until:
+                    max_until = tw.until
+                max_untils.append(max_until)
+            self.__index = (sinces, max_untils)
+        return self.__index
+
+    def overlapping(self, time_window):
+        """
+        Get the time windows of this collection that overlap with a given
+        time window. Instead of scanning the whole collection, the candidates
+        are narrowed down with two binary searches on the search index.
+
+        :param TimeWindow time_window: The time window to check against
+        :rtype: TimeWindowsCollection
+        """
+        sinces, max_untils = self._get_index()
+        # Windows after hi start at or after the end of time_window and
+        # windows before lo (and every window before them) end at or before
+        # its start.
+        hi = bisect_left(sinces, time_window.until)
+        lo = bisect_right(max_untils, time_window.since, 0, hi)
+        candidates = self.time_windows_sorted_by_since[lo:hi]
+        return TimeWindowsCollection(
+            [tw for tw in candidates if tw.overlaps(time_window)],
+            sorted_since=True
+        )
+
+    def contains(self, other):
+        """
+        Check if a specific time stamp is contained in any of the time
+        windows of this collection. The candidate windows are narrowed down
+        with binary searches on the search index.
+
+        Using "in" operator produces the same result.
+        :param datetime other: The time stamp to check
+        :rtype: bool
+        """
+        if not isinstance(other, datetime):
+            raise TypeError("Operator 'in' for {0} is undefined"
+                            .format(other))
+        sinces, max_untils = self._get_index()
+        hi = bisect_right(sinces, other)
+        lo = bisect_right(max_untils, other, 0, hi)
+        for tw in self.time_windows_sorted_by_since[lo:hi]:
+            if other < tw._until:
+                return True
+        return False
+    __contains__ = contains
+
     def compressed(self):
         """
         Compress the list of time windows in the smallest possible equivalent
         list of time windows that define the same time area as the former one.
+        The result is cached, and compressing an already compressed
+        collection returns it as is.
 
-        :rtype: list[TimeWindow]
+        :rtype: TimeWindowsCollection
         """
+        if self.__is_compressed:
+            return self
+        if self.__compressed is not None:
+            return self.__compressed
         time_windows = self.time_windows_sorted_by_since
-        if not time_windows:
-            return TimeWindowsCollection([])
         stack = []
 
-        latest = {
-            'since': None,
-            'until': None
-        }
-
-        for current in time_windows:
-            if latest['until'] is None:
-                latest['since'] = current.since
-                latest['until'] = current.until
-            elif latest['until'] >= current.since:
-                latest['until'] = max(latest['until'], current.until)
-            else:
-                stack.append(TimeWindow(latest['since'], latest['until']))
-                latest['since'] = current.since
-                latest['until'] = current.until
-
-        stack.append(TimeWindow(latest['since'], latest['until']))
-        return TimeWindowsCollection(stack, sorted_since=True)
+        if time_windows:
+            # Sweep the windows in ascending order of since, extending the
+            # current window while the next one starts before it ends.
+            latest_since = time_windows[0]._since
+            latest_until = time_windows[0]._until
+            for current in time_windows:
+                if current._since <= latest_until:
+                    if current._until > latest_until:
+                        latest_until = current._until
+                else:
+                    stack.append(TimeWindow(latest_since, latest_until))
+                    latest_since = current._since
+                    latest_until = current._until
+            stack.append(TimeWindow(latest_since, latest_until))
+
+        compressed = TimeWindowsCollection(stack, sorted_since=True)
+        compressed.__is_compressed = True
+        self.__compressed = compressed
+        return compressed
 
     def complement(self, period):
         """
@@ -398,13 +573,35 @@ class TimeWindowsCollection(object):
 
         :param TimeWindow period: The bigger time range to get the complement
         of.
-        :rtype: list[TimeWindow]
+        :rtype: TimeWindowsCollection
         """
-        inverse = [period]
-        time_windows = self.time_windows_sorted_by_since
-        for tw in time_windows:
-            inverse[-1:] = make_sequence(inverse[-1] - tw)
-        return TimeWindowsCollection(inverse, sorted_since=True)
+        since, until = period._since, period._until
+        if since >= until:
+            # An empty period does not overlap with anything
+            return TimeWindowsCollection([period], sorted_since=True)
+
+        # The windows of the compressed collection are sorted and disjoint,
+        # so the complement is made of the gaps between them.
+        # Only the windows that end after the start of the period and start
+        # before its end are visited; they are located with binary searches.
+        compressed = self.compressed()
+        sinces, untils = compressed._get_index()
+        lo = bisect_right(untils, since)
+        hi = bisect_left(sinces, until, lo)
+        gaps = []
+        for tw in compressed.time_windows[lo:hi]:
+            if tw._since >= tw._until:
+                # An empty window does not split a gap
+                continue
+            if tw._since > since:
+                gaps.append(TimeWindow(since, tw._since))
+            since = tw._until
+        if since < until:
+            gaps.append(TimeWindow(since, until))
+
+        complement = TimeWindowsCollection(gaps, sorted_since=True)
+        complement.__is_compressed = True
+        return complement
 
     def __repr__(self):
         return repr(self.time_windows)